@@ -6,20 +6,42 @@ Daily TrueNAS replication health check.
 - Sends a simple up/down ping to Uptime Kuma
 """
 
+import functools
 import json
 import subprocess
-from dataclasses import dataclass
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
 import time
 from datetime import datetime, date
 
 from urllib.request import urlopen
-from urllib.parse import quote
+from urllib.parse import quote_from_bytes
 import argparse
 import sys
 
+try:
+    import orjson
 
-@dataclass
+    _loads = orjson.loads
+except ImportError:  # orjson is optional, fall back to the standard library
+    _loads = json.loads
+
+
+@functools.cache
+def _today_start_ms() -> int:
+    """
+    Epoch timestamp (milliseconds) of local midnight today.
+
+    Computed once per run, the script is a one-shot cron job that does not
+    outlive the day it was started on.
+
+    :return: Epoch millis of the start of the current day
+    """
+    return int(datetime.combine(date.today(), datetime.min.time()).timestamp() * 1000)
+
+
+@dataclass(slots=True)
 class ReplicationTask:
     """
     Represents a ZFS replication task on TrueNAS.
@@ -31,6 +53,8 @@ class ReplicationTask:
     :param last_datetime: Epoch timestamp (milliseconds) of the last run
     :param last_snapshot: Name of the last snapshot processed
     :param error: Error message if the task failed
+    :param ok: Whether the task completed successfully (FINISHED without errors),
+        derived from state and error when the task is created
     """
 
     id: int
@@ -42,6 +66,12 @@ class ReplicationTask:
     last_datetime: Optional[int] = None  # epoch millis
     last_snapshot: Optional[str] = None
     error: Optional[str] = None
+    ok: bool = field(init=False)
+
+    def __post_init__(self) -> None:
+        # Tasks are never mutated after creation, so compute this once
+        # instead of on every read
+        self.ok = self.state == "FINISHED" and not self.error
 
     @classmethod
     def from_midclt(cls, data: dict) -> "ReplicationTask":
@@ -67,15 +97,6 @@ class ReplicationTask:
             error=state_block.get("error"),
         )
 
-    @property
-    def ok(self) -> bool:
-        """
-        Check if the replication task completed successfully (FINISHED without errors).
-
-        :return: True if successful, False otherwise
-        """
-        return self.state == "FINISHED" and not self.error
-
     @property
     def ran_today(self) -> bool:
         """
@@ -83,26 +104,24 @@ class ReplicationTask:
 
         :return: True if last run was today, False otherwise
         """
-        if not self.last_datetime:
+        last_datetime = self.last_datetime
+        if not last_datetime:
             return False
 
-        run_date = datetime.fromtimestamp(self.last_datetime / 1000).date()
-        return run_date == date.today()
+        return last_datetime >= _today_start_ms()
 
-    def is_within_window(self, window: int) -> bool:
+    def is_within_window(self, now_ms: int, window_ms: int) -> bool:
         """
-        Check if the task finished successfully within the last X hours.
+        Check if the task finished successfully within the given window.
 
-        :param window: allwoed time window in hours since the last replication
+        :param now_ms: current epoch timestamp in milliseconds
+        :param window_ms: allowed time window in milliseconds since the last replication
         """
-        if not self.last_datetime or not self.ok:
+        last_datetime = self.last_datetime
+        if not last_datetime or not self.ok:
             return False
 
-        # Calculate time difference
-        last_run_time = datetime.fromtimestamp(self.last_datetime / 1000)
-        time_diff = datetime.now() - last_run_time
-
-        return time_diff.total_seconds() <= (window * 3600)
+        return (now_ms - last_datetime) <= window_ms
 
     @property
     def up_to_date(self) -> bool:
@@ -114,48 +133,104 @@ class ReplicationTask:
         return self.ok and self.ran_today
 
 
-def get_replication_tasks() -> list[ReplicationTask]:
+def iter_raw_tasks(enabled_only: bool = False) -> Iterator[dict]:
     """
-    Query TrueNAS middleware for replication tasks and return ReplicationTask objects.
+    Query TrueNAS middleware for replication tasks and yield the raw task dictionaries.
 
-    :return: List of ReplicationTask objects
+    :param enabled_only: Let the middleware filter out disabled tasks
+    :return: Iterator over the task dictionaries from `midclt call replication.query`
     """
+    cmd = ["midclt", "call", "replication.query"]
+    if enabled_only:
+        cmd.append('[["enabled", "=", true]]')
+
     try:
         result = subprocess.run(
-            ["midclt", "call", "replication.query"],
+            cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
             check=True,
         )
     except subprocess.CalledProcessError as e:
         print(
-            f"[{time.ctime()}] ERROR: midclt replication.query failed: {e.stderr.strip()}"
+            f"[{time.ctime()}] ERROR: midclt replication.query failed: "
+            f"{e.stderr.decode(errors='replace').strip()}"
         )
-        return []
+        return
 
     try:
-        raw_tasks = json.loads(result.stdout)
+        # Parse the raw bytes directly, no intermediate str decode
+        raw_tasks = _loads(result.stdout)
     except json.JSONDecodeError:
         print(f"[{time.ctime()}] ERROR: Failed to parse replication.query JSON output")
-        return []
+        return
 
     if not isinstance(raw_tasks, list):
         print(f"[{time.ctime()}] ERROR: Unexpected replication.query output format")
-        return []
+        return
+
+    yield from raw_tasks
+
+
+def _task_from_raw(data: dict) -> Optional[ReplicationTask]:
+    """
+    Build a ReplicationTask from raw middleware data, skipping malformed entries.
+
+    :param data: Dictionary from `midclt call replication.query`
+    :return: ReplicationTask instance, or None if a required field is missing
+    """
+    try:
+        return ReplicationTask.from_midclt(data)
+    except KeyError as e:
+        print(
+            f"[{time.ctime()}] WARNING: Skipping malformed replication task "
+            f"(missing field {e})"
+        )
+        return None
+
 
-    tasks: list[ReplicationTask] = []
+def get_replication_tasks(enabled_only: bool = False) -> list[ReplicationTask]:
+    """
+    Query TrueNAS middleware for replication tasks and return ReplicationTask objects.
+
+    :param enabled_only: Let the middleware filter out disabled tasks
+    :return: List of ReplicationTask objects
+    """
+    tasks = (_task_from_raw(task) for task in iter_raw_tasks(enabled_only))
+    return [t for t in tasks if t is not None]
+
+
+def _fast_check(
+    raw_tasks: Iterable[dict], now_ms: int, window_ms: int
+) -> tuple[bool, list[dict]]:
+    """
+    Check raw middleware task data against the window without building task objects.
+
+    :param raw_tasks: Task dictionaries from `midclt call replication.query`
+    :param now_ms: current epoch timestamp in milliseconds
+    :param window_ms: allowed time window in milliseconds since the last replication
+    :return: Tuple of (any enabled task found, raw data of the outdated tasks)
+    """
+    found = False
+    outdated_raw: list[dict] = []
+
+    for raw in raw_tasks:
+        if not raw.get("enabled", False):
+            continue
+        found = True
 
-    for task in raw_tasks:
-        try:
-            tasks.append(ReplicationTask.from_midclt(task))
-        except KeyError as e:
-            print(
-                f"[{time.ctime()}] WARNING: Skipping malformed replication task "
-                f"(missing field {e})"
-            )
+        state_block = raw.get("state") or {}
+        last_run = state_block.get("datetime")
+        last_datetime = last_run.get("$date") if isinstance(last_run, dict) else None
+        if not (
+            last_datetime
+            and state_block.get("state") == "FINISHED"
+            and not state_block.get("error")
+            and (now_ms - last_datetime) <= window_ms
+        ):
+            outdated_raw.append(raw)
 
-    return tasks
+    return found, outdated_raw
 
 
 def check_all_replications(window: int) -> bool:
@@ -165,19 +240,24 @@ def check_all_replications(window: int) -> bool:
     :param window: allwoed time window in hours since the last replication
     :return: True if all enabled tasks are up-to-date, False otherwise
     """
-    tasks = get_replication_tasks()
-    enabled_tasks = [t for t in tasks if t.enabled]
+    # Compare raw epoch millis instead of building datetime objects per task
+    now_ms = int(time.time() * 1000)
+    window_ms = int(window * 3_600_000)
 
-    if not enabled_tasks:
+    # Disabled tasks are filtered on the middleware side, less JSON to transfer and parse
+    found, outdated_raw = _fast_check(iter_raw_tasks(enabled_only=True), now_ms, window_ms)
+
+    if not found:
         print(f"[{time.ctime()}] No enabled replication tasks found.")
         return True
 
-    outdated = [t for t in enabled_tasks if not t.is_within_window(window)]
-
-    if outdated:
+    if outdated_raw:
+        # Only the offenders are turned into ReplicationTask objects for the report
+        outdated = (_task_from_raw(raw) for raw in outdated_raw)
         print(f"[{time.ctime()}] Found outdated replications within the {window}h window:")
-        for t in outdated:
-            reason = t.error or f"state={t.state} (Last run: {datetime.fromtimestamp(t.last_datetime/1000)})"
+        for t in filter(None, outdated):
+            last_run = datetime.fromtimestamp(t.last_datetime / 1000) if t.last_datetime else "never"
+            reason = t.error or f"state={t.state} (Last run: {last_run})"
             print(f"  - {t.name}: {reason}")
         return False
 
@@ -192,13 +272,17 @@ def notify_uptime_kuma(
     Send a simple up/down ping to an Uptime Kuma monitor.
 
     :param up: True for "up", False for "down"
-    :param kuma_url: Base URL of Uptime Kuma instance (without trailing slash)
+    :param kuma_url: Base URL of Uptime Kuma instance (without trailing slash),
+        https is assumed if it has no scheme
     :param kuma_token: Push token for the monitor
     :param msg: Optional short message (default: "OK")
     :return: True if HTTP request succeeded (2xx), False otherwise
     """
     status = "up" if up else "down"
-    encoded_msg = quote(msg)
+    # Encode once up front, also escaping "/" which plain quote() keeps
+    encoded_msg = quote_from_bytes(msg.encode("utf-8"), safe=b"")
+    if "://" not in kuma_url:
+        kuma_url = f"https://{kuma_url}"
     url = f"{kuma_url}/api/push/{kuma_token}?status={status}&msg={encoded_msg}&ping="
 
     try:
@@ -214,6 +298,31 @@ def notify_uptime_kuma(
         return False
 
 
+def notify_all(
+    up: bool, kuma_url: str, kuma_tokens: list[str], msg: str = "OK"
+) -> bool:
+    """
+    Push the same up/down status to several Uptime Kuma monitors concurrently.
+
+    A stalled monitor only delays its own push, so the total wait is the slowest
+    request instead of the sum of all of them.
+
+    :param up: True for "up", False for "down"
+    :param kuma_url: Base URL of Uptime Kuma instance (without trailing slash)
+    :param kuma_tokens: Push tokens of the monitors to notify
+    :param msg: Optional short message (default: "OK")
+    :return: True if every monitor was notified successfully, False otherwise
+    """
+    if len(kuma_tokens) == 1:
+        return notify_uptime_kuma(up, kuma_url, kuma_tokens[0], msg)
+
+    with ThreadPoolExecutor(max_workers=min(16, len(kuma_tokens))) as pool:
+        results = pool.map(
+            lambda token: notify_uptime_kuma(up, kuma_url, token, msg), kuma_tokens
+        )
+        return all(list(results))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Check TrueNAS replication health and notify Uptime Kuma."
@@ -221,7 +330,12 @@ def main():
     parser.add_argument(
         "--kuma-url", required=True, help="Uptime Kuma base URL, e.g., kuma.example.com"
     )
-    parser.add_argument("--kuma-token", required=True, help="Uptime Kuma push token")
+    parser.add_argument(
+        "--kuma-token",
+        required=True,
+        nargs="+",
+        help="Uptime Kuma push token (several tokens notify several monitors)",
+    )
     parser.add_argument(
         "--msg-up", default="Replication OK", help="Message when replication is healthy"
     )
@@ -237,10 +351,10 @@ def main():
     args = parser.parse_args()
 
     if check_all_replications(args.window):
-        notify_uptime_kuma(True, args.kuma_url, args.kuma_token, args.msg_up)
+        notify_all(True, args.kuma_url, args.kuma_token, args.msg_up)
         sys.exit(0)
     else:
-        notify_uptime_kuma(False, args.kuma_url, args.kuma_token, args.msg_down)
+        notify_all(False, args.kuma_url, args.kuma_token, args.msg_down)
         sys.exit(1)
 
 
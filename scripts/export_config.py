@@ -21,12 +21,12 @@
 #
 
 import argparse
-import subprocess
+import socket
 import sys
 import os
+import stat
 import time
 import tarfile
-import glob
 from pathlib import Path
 from typing import List
 
@@ -45,7 +45,7 @@ def get_system_info() -> tuple[str, str]:
     Returns:
         tuple: (hostname, version_string)
     """
-    hostname = subprocess.getoutput("hostname").strip()
+    hostname = socket.gethostname()
     version = "unknown"
     version_path = Path("/etc/version")
 
@@ -71,16 +71,57 @@ def cleanup_old_exports(destination: Path, hostname: str, days: int) -> None:
     print(f"[{time.ctime()}] Cleaning up '{destination}' older than {days} days.")
     cutoff = time.time() - (days * 86400)
 
-    # Matches files starting with 'config-export-[hostname]'
-    pattern = str(destination / f"config-export-{hostname}-*.tar")
-    for f_str in glob.glob(pattern):
-        f_path = Path(f_str)
-        if f_path.stat().st_mtime < cutoff:
-            try:
-                f_path.unlink()
-                print(f"[{time.ctime()}] Deleted old export: {f_path.name}")
-            except OSError as e:
-                print(f"[{time.ctime()}] Error deleting {f_path.name}: {e}")
+    # Matches files starting with 'config-export-[hostname]', single directory pass
+    prefix = f"config-export-{hostname}-"
+    with os.scandir(destination) as it:
+        for entry in it:
+            if not (entry.name.startswith(prefix) and entry.name.endswith(".tar")):
+                continue
+            # lstat semantics: a symlink is judged by its own mtime, never its target
+            if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                    print(f"[{time.ctime()}] Deleted old export: {entry.name}")
+                except OSError as e:
+                    print(f"[{time.ctime()}] Error deleting {entry.name}: {e}")
+
+
+def add_tar_member(fd_out: int, file_path: Path, arcname: str) -> None:
+    """
+    Append a regular file to an uncompressed tar stream.
+
+    The header is rendered by tarfile, the file data is copied by the kernel
+    with os.sendfile() so it never passes through Python buffers.
+
+    Args:
+        fd_out: File descriptor of the archive, positioned at its end.
+        file_path: Regular file to add.
+        arcname: Name of the member inside the archive.
+    """
+    fd_in = os.open(file_path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd_in)
+        info = tarfile.TarInfo(arcname)
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.uid, info.gid = st.st_uid, st.st_gid
+        os.write(fd_out, info.tobuf())
+
+        offset = 0
+        while offset < st.st_size:
+            sent = os.sendfile(fd_out, fd_in, offset, st.st_size - offset)
+            if sent == 0:
+                # Same failure tarfile reports when a file shrinks while archived
+                raise OSError(f"unexpected end of data in {file_path}")
+            offset += sent
+
+        # Pad the member data up to the next block boundary
+        remainder = st.st_size % tarfile.BLOCKSIZE
+        if remainder:
+            os.write(fd_out, bytes(tarfile.BLOCKSIZE - remainder))
+    finally:
+        os.close(fd_in)
 
 
 def run_export(destination: Path, include_secret: bool, retention: int) -> None:
@@ -107,13 +148,19 @@ def run_export(destination: Path, include_secret: bool, retention: int) -> None:
     print(f"[{time.ctime()}] Starting export to '{target_path}'")
 
     try:
-        with tarfile.open(target_path, "w") as tar:
+        # The archive holds the secret seed, keep it private to root
+        fd_out = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
             for file_name in files_to_archive:
                 file_path = source_dir / file_name
                 if file_path.exists():
-                    tar.add(file_path, arcname=file_name)
+                    add_tar_member(fd_out, file_path, file_name)
                 else:
                     print(f"[{time.ctime()}] Warning: {file_name} not found in {source_dir}")
+            # End-of-archive marker: two zero-filled blocks
+            os.write(fd_out, bytes(2 * tarfile.BLOCKSIZE))
+        finally:
+            os.close(fd_out)
 
         print(f"[{time.ctime()}] Configuration successfully exported.")
         cleanup_old_exports(destination, hostname, retention)
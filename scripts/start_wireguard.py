@@ -11,7 +11,7 @@
 #
 # It performs three checks:
 # 1. Verifies that the configuration file exists.
-# 2. Checks if the specified WireGuard interface is already active using 'wg show'.
+# 2. Checks if the specified WireGuard interface is already active via /sys/class/net.
 # 3. If the interface is not active, it brings it up using 'wg-quick up'.
 #
 # The script is idempotent: it will do nothing if the interface is already up,
@@ -29,44 +29,54 @@
 #
 
 import argparse
-import subprocess
+import os
 import sys
 from pathlib import Path
 import time
 
 
+def spawn_quiet(argv: list[str]) -> int:
+    """Run a command quietly via posix_spawnp and return its exit code."""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        pid = os.posix_spawnp(
+            argv[0],
+            argv,
+            os.environ,
+            file_actions=[
+                (os.POSIX_SPAWN_DUP2, devnull, 1),
+                (os.POSIX_SPAWN_DUP2, devnull, 2),
+            ],
+        )
+    finally:
+        os.close(devnull)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
 def interface_exists(config: Path):
     """Check if a WireGuard interface is already active."""
     print(f"[{time.ctime()}] Checking if interface '{config.stem}' exists.")
-    try:
-        # wg show returns exit code 0 if the interface is up
-        _ = subprocess.check_output(
-            ["wg", "show", config.stem], stderr=subprocess.DEVNULL
-        )
+    # Every network interface, WireGuard included, has a sysfs entry while it exists
+    if Path(f"/sys/class/net/{config.stem}").is_dir():
         print(f"[{time.ctime()}] Interface '{config.stem}' is already up.")
         return True
-    except subprocess.CalledProcessError:
-        # wg show returns non-zero if the interface is not up
-        print(f"[{time.ctime()}] Interface '{config.stem}' does not exist.")
-        return False
+    print(f"[{time.ctime()}] Interface '{config.stem}' does not exist.")
+    return False
 
 
 def bring_up_interface(config: Path):
     """Bring up the WireGuard interface using wg-quick with a given config file."""
     print(f"[{time.ctime()}] Attempting to bring up WireGuard using config '{config}'.")
-    try:
-        subprocess.run(
-            ["wg-quick", "up", config],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+    exit_code = spawn_quiet(["wg-quick", "up", str(config)])
+    if exit_code == 0:
         print(
             f"[{time.ctime()}] WireGuard interface '{config.stem}' from '{config}' brought up successfully."
         )
-    except subprocess.CalledProcessError as e:
+    else:
         print(
-            f"[{time.ctime()}] Failed to bring up WireGuard interface '{config.stem}' from '{config}': {e}"
+            f"[{time.ctime()}] Failed to bring up WireGuard interface '{config.stem}' from '{config}': "
+            f"wg-quick returned non-zero exit status {exit_code}."
         )
         # Exit with a non-zero code if interface creation fails
         sys.exit(1)
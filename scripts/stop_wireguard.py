@@ -5,16 +5,19 @@
 # shuts down a WireGuard interface if no replication is detected within a grace period.
 #
 # It is designed to be called periodically by a cron job (e.g., every 5–15 minutes).
-# Internally, it uses the TrueNAS middleware command:
-#     midclt call core.get_jobs
-# to check for active ZFS replication jobs via the TrueNAS API.
+# Internally, it calls the TrueNAS middleware method:
+#     core.get_jobs
+# to check for active ZFS replication jobs via the TrueNAS API. The connection to
+# middlewared is kept open across polls; `midclt call` is used as a fallback.
 #
 # The script implements a configurable grace period by polling the replication state
 # for the duration of the --timeout argument (e.g., 60 seconds).
 #
 # 1. It first checks if the specified WireGuard interface is UP. If it’s DOWN, the script exits immediately.
 # 2. If the interface is UP, it continuously checks for ZFS replication jobs in the RUNNING state every --interval seconds.
+#    When run as root, kernel process events wake the check up early as soon as a `zfs` command is started.
 # 3. If any replication job is found (RUNNING), the script exits immediately, leaving the interface up.
+#    With --traffic-threshold, more than that many bytes crossing the tunnel has the same effect.
 # 4. If the full --timeout elapses without detecting any active replication, the WireGuard interface
 #    is brought down using `wg-quick down`.
 #
@@ -28,9 +31,9 @@
 #
 # REQUIREMENTS:
 #   - TrueNAS system (CORE or SCALE)
-#   - Python 3.9+
+#   - Python 3.10+
 #   - WireGuard installed and configured
-#   - Sufficient privileges to run `wg`, `wg-quick`, and `midclt`
+#   - Sufficient privileges to run `wg-quick` and `midclt`
 #
 # EXIT BEHAVIOR:
 #   0 — Interface already down or successfully brought down
@@ -39,13 +42,34 @@
 #
 
 import json
+import os
+import select
+import signal
+import socket
+import struct
 import subprocess
 import time
 import argparse
+import functools
 import sys
 from pathlib import Path
 from enum import Enum
 
+# Connection to middlewared, opened on first use and reused by every poll.
+# False once the connection failed, every later call then goes through midclt.
+_middleware = None
+
+# Netlink process connector, see linux/connector.h and linux/cn_proc.h
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+PROC_EVENT_EXEC = 0x00000002
+NLMSG_DONE = 3
+# nlmsghdr (16 bytes) + cn_msg header (20 bytes) precede the proc_event
+PROC_EVENT_OFFSET = 36
+
 class JobState(Enum):
     """Valid job states for TrueNAS core.get_jobs."""
     RUNNING = "RUNNING"
@@ -56,6 +80,14 @@ class JobState(Enum):
     BLOCKED = "BLOCKED"
     PENDING = "PENDING"
 
+# core.get_jobs queries are constant, build (and encode) them only once
+REPLICATION_FILTER = ["method", "~", "replication"]
+RUNNING_REPLICATIONS_COUNT = (
+    [REPLICATION_FILTER, ["state", "=", JobState.RUNNING.value]],
+    {"count": True},
+)
+RUNNING_REPLICATIONS_COUNT_JSON = tuple(json.dumps(p) for p in RUNNING_REPLICATIONS_COUNT)
+
 def get_zfs_replication_jobs(state: JobState | None = None) -> list:
     """ 
     Query TrueNAS middleware for replication jobs, optionally filtered by state.
@@ -63,21 +95,81 @@ def get_zfs_replication_jobs(state: JobState | None = None) -> list:
     :param state: Optional JobState to filter by (e.g., RUNNING)
     :return: List of job dictionaries from TrueNAS middleware
     """
-    query = [["method", "~", "replication"]]
+    query = [REPLICATION_FILTER]
     if state is not None:
         if not isinstance(state, JobState):
             raise ValueError(f"Invalid job state: '{state}'. Must be a JobState Enum member.")
         query.append(["state", "=", state.value])
     # query API
+    return middleware_call("core.get_jobs", query)
+
+@functools.cache
+def middleware_client_class():
+    """
+    Import the TrueNAS middleware client library on first use.
+
+    The library ships with TrueNAS (it is what `midclt` uses internally). Its import
+    is comparatively slow, so it is deferred until the first middleware query and
+    runs that exit early never pay for it.
+
+    :return: Tuple of (Client class, ClientException class), or None if the library
+        is not available
+    """
+    try:
+        from truenas_api_client import Client, ClientException
+    except ImportError:
+        try:
+            from middlewared.client import Client, ClientException
+        except ImportError:
+            return None
+    return Client, ClientException
+
+def middleware_call(method: str, *params, encoded: tuple[str, ...] | None = None):
+    """
+    Call a TrueNAS middleware method over a persistent connection.
+
+    The connection to middlewared is opened once and reused, so polling does not
+    pay for a `midclt` process start and handshake on every call. If the client
+    library is missing or the connection cannot be opened or breaks, `midclt call`
+    is used instead for the rest of the run. Errors returned by the middleware
+    itself are raised as they are.
+
+    :param method: Middleware method name (e.g., core.get_jobs)
+    :param params: Positional method parameters, JSON serializable
+    :param encoded: The same parameters already JSON encoded, saves re-encoding
+        constant queries for the `midclt` fallback
+    :return: Decoded result of the call
+    """
+    global _middleware
+    if _middleware is None:
+        client = middleware_client_class()
+        if client is None:
+            _middleware = False
+        else:
+            client_class, client_exception = client
+            try:
+                _middleware = client_class()
+            except (OSError, client_exception) as e:
+                print(f"[{time.ctime()}] Middleware connection failed, falling back to midclt: {e}")
+                _middleware = False
+
+    if _middleware is not False:
+        try:
+            return _middleware.call(method, *params)
+        except OSError as e:
+            # Transport error, the connection is gone. Don't reconnect on every poll.
+            print(f"[{time.ctime()}] Middleware connection lost, falling back to midclt: {e}")
+            _middleware.close()
+            _middleware = False
+
     result = subprocess.run(
-        ["midclt", "call", "core.get_jobs", json.dumps(query)],
+        ["midclt", "call", method, *(encoded or (json.dumps(p) for p in params))],
         stdout=subprocess.PIPE,
         text=True,
         check=True,
     )
     # Parse result into a list
-    jobs = json.loads(result.stdout)
-    return jobs
+    return json.loads(result.stdout)
 
 def replication_running() -> bool:
     """
@@ -85,46 +177,255 @@ def replication_running() -> bool:
     
     :return: True if at least one replication job is RUNNING, False otherwise
     """
-    jobs = get_zfs_replication_jobs(JobState.RUNNING)
-    print(f"[{time.ctime()}] Found {len(jobs)} running replication job(s).")
-    return bool(jobs)
+    count = get_running_replication_count()
+    print(f"[{time.ctime()}] Found {count} running replication job(s).")
+    return count > 0
+
+
+def get_running_replication_count() -> int:
+    """
+    Count running replication jobs without transferring the job details.
+
+    The `count` query option makes the middleware return a single integer instead
+    of every job with its arguments, progress and logs.
+
+    :return: Number of replication jobs in the RUNNING state
+    """
+    return middleware_call(
+        "core.get_jobs", *RUNNING_REPLICATIONS_COUNT, encoded=RUNNING_REPLICATIONS_COUNT_JSON
+    )
+
+
+def open_exec_monitor() -> socket.socket | None:
+    """
+    Subscribe to kernel process exec events through the netlink process connector.
+
+    Requires root (CAP_NET_ADMIN). If the kernel or the privileges do not allow
+    it, the caller falls back to plain interval polling.
+
+    :return: Netlink socket delivering process events, or None if unavailable
+    """
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+    except (AttributeError, OSError):
+        # No AF_NETLINK (non-Linux) or connector support
+        return None
+
+    try:
+        sock.bind((0, CN_IDX_PROC))
+        send_proc_cn_op(sock, PROC_CN_MCAST_LISTEN)
+    except OSError as e:
+        print(f"[{time.ctime()}] Process event monitor unavailable ({e}), using plain polling.")
+        sock.close()
+        return None
+    return sock
+
+
+def send_proc_cn_op(sock: socket.socket, op: int) -> None:
+    """
+    Send a PROC_CN_MCAST_* control message to the process connector.
+
+    :param sock: Bound netlink connector socket
+    :param op: PROC_CN_MCAST_LISTEN or PROC_CN_MCAST_IGNORE
+    """
+    payload = struct.pack("=I", op)
+    cn_msg = struct.pack("=IIIIHH", CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+    nl_hdr = struct.pack("=IHHII", 16 + len(cn_msg), NLMSG_DONE, 0, 0, sock.getsockname()[0])
+    sock.send(nl_hdr + cn_msg)
+
+
+def close_exec_monitor(monitor: socket.socket | None) -> None:
+    """
+    Unsubscribe from process events and close the socket.
+
+    Kernels before 6.6 only drop their global listener count on an explicit
+    PROC_CN_MCAST_IGNORE, closing the socket alone would leave the kernel
+    generating process events for every later run.
+
+    :param monitor: Socket returned by open_exec_monitor, or None
+    """
+    if monitor is None:
+        return
+    try:
+        send_proc_cn_op(monitor, PROC_CN_MCAST_IGNORE)
+    except OSError:
+        pass
+    finally:
+        monitor.close()
+
+
+def zfs_exec_seen(monitor: socket.socket) -> bool:
+    """
+    Drain pending process events and check whether any of them started `zfs`.
+
+    :param monitor: Socket returned by open_exec_monitor
+    :return: True if a zfs process was exec'd (or events were lost), False otherwise
+    """
+    found = False
+    while True:
+        try:
+            data = monitor.recv(4096, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return found
+        except OSError:
+            # Receive buffer overflowed (ENOBUFS), events were dropped: assume activity
+            return True
+
+        if len(data) < PROC_EVENT_OFFSET + 24:
+            continue
+        what, = struct.unpack_from("=I", data, PROC_EVENT_OFFSET)
+        if what != PROC_EVENT_EXEC:
+            continue
+        # proc_event: what, cpu, timestamp_ns, then exec data: pid, tgid
+        tgid, = struct.unpack_from("=I", data, PROC_EVENT_OFFSET + 20)
+        try:
+            fd = os.open(f"/proc/{tgid}/cmdline", os.O_RDONLY)
+            try:
+                argv0 = os.read(fd, 4096).split(b"\x00", 1)[0]
+            finally:
+                os.close(fd)
+        except OSError:
+            # Already exited
+            continue
+        if os.path.basename(argv0) == b"zfs":
+            found = True
+
+
+def wait_for_zfs_exec(
+    poller: select.poll, monitor: socket.socket | None, timeout: float
+) -> bool:
+    """
+    Sleep up to `timeout` seconds, returning early when a `zfs` process is started.
+
+    :param poller: Poll object with `monitor` registered for POLLIN (empty without one)
+    :param monitor: Socket returned by open_exec_monitor, or None
+    :param timeout: Maximum time to wait in seconds
+    :return: True if woken early by a zfs process, False if the timeout elapsed
+    """
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        # With nothing registered this is a plain sleep
+        if poller.poll(remaining * 1000) and zfs_exec_seen(monitor):
+            return True
+    return False
 
 
-def interface_is_up(config: Path) -> bool:
+def interface_is_up(iface: str) -> bool:
     """
     Check if the WireGuard interface is already active.
 
-    :param config: Path to WireGuard config file
+    :param iface: WireGuard interface name
     :return: True if interface is UP, False if DOWN
     """
+    # The interface has a sysfs entry for as long as it exists
+    return os.path.isdir(f"/sys/class/net/{iface}")
+
+
+def spawn_quiet(argv: list[str]) -> int:
+    """
+    Run a command with its output sent to /dev/null and wait for it.
+
+    :param argv: Command and arguments, argv[0] is looked up in PATH
+    :return: Exit code of the command
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
     try:
-        subprocess.check_output(["wg", "show", config.stem], stderr=subprocess.DEVNULL)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+        pid = os.posix_spawnp(
+            argv[0],
+            argv,
+            os.environ,
+            file_actions=[
+                (os.POSIX_SPAWN_DUP2, devnull, 1),
+                (os.POSIX_SPAWN_DUP2, devnull, 2),
+            ],
+        )
+    finally:
+        os.close(devnull)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
 
 
-def bring_down_interface(config: Path):
+def interface_traffic_bytes(iface: str) -> int:
+    """
+    Read the total bytes received and sent through an interface from sysfs.
+
+    :param iface: WireGuard interface name
+    :return: rx_bytes + tx_bytes, 0 if the interface no longer exists
+    """
+    total = 0
+    for counter in ("rx_bytes", "tx_bytes"):
+        try:
+            with open(f"/sys/class/net/{iface}/statistics/{counter}", "rb") as f:
+                total += int(f.read())
+        except (OSError, ValueError):
+            return 0
+    return total
+
+
+def bring_down_interface(config: str, iface: str):
     """
     Bring down the WireGuard interface using wg-quick.
 
     :param config: Path to WireGuard config file
+    :param iface: WireGuard interface name (stem of the config file)
     """
-    print(f"[{time.ctime()}] Attempting to bring down '{config.stem}'...")
-    try:
-        subprocess.run(
-            ["wg-quick", "down", config],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+    print(f"[{time.ctime()}] Attempting to bring down '{iface}'...")
+    exit_code = spawn_quiet(["wg-quick", "down", config])
+    if exit_code == 0:
+        print(f"[{time.ctime()}] Interface '{iface}' successfully brought down.")
+    else:
+        print(
+            f"[{time.ctime()}] Failed to bring down '{iface}': "
+            f"wg-quick returned non-zero exit status {exit_code}."
         )
-        print(f"[{time.ctime()}] Interface '{config.stem}' successfully brought down.")
-    except subprocess.CalledProcessError as e:
-        print(f"[{time.ctime()}] Failed to bring down '{config.stem}': {e}")
         # Exit with error code if the shutdown itself fails
         sys.exit(1)
 
 
+def resolve_config(interface: str | None, config: str | None) -> Path:
+    """
+    Build the absolute path of the WireGuard config, --config taking precedence.
+
+    The path is resolved like in start_wireguard.py, so a symlinked config maps to
+    the same interface name (wg-quick names the interface after the file stem).
+
+    :param interface: WireGuard interface name (e.g. wg0)
+    :param config: Path to a WireGuard config file
+    :return: Resolved config path
+    """
+    return Path(config if config else f"/etc/wireguard/{interface}.conf").resolve()
+
+
+class GracePeriodExpired(BaseException):
+    """
+    Raised from the SIGALRM handler when the grace period is over.
+
+    Derives from BaseException (like KeyboardInterrupt) so that the broad
+    `except Exception` / `except OSError` fallbacks in the checks cannot swallow it.
+    """
+
+
+def raise_grace_period_expired(signum, frame):
+    """SIGALRM handler ending the grace period."""
+    raise GracePeriodExpired
+
+
+def positive_int(value: str) -> int:
+    """argparse type for integers >= 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def non_negative_int(value: str) -> int:
+    """argparse type for integers >= 0."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {number}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=(
@@ -142,56 +443,100 @@ def main():
     )
     parser.add_argument(
         "--interval",
-        type=int,
+        type=positive_int,
         default=5,
         help="Polling interval in seconds (default: 5)",
     )
+    parser.add_argument(
+        "--traffic-threshold",
+        type=non_negative_int,
+        default=0,
+        help=(
+            "Keep the interface up if more than this many bytes crossed it during the "
+            "grace period; checked before querying TrueNAS (default: 0, disabled)"
+        ),
+    )
     args = parser.parse_args()
 
     # Require at least one argument
     if not args.interface and not args.config:
         parser.error("You must specify either --interface or --config.")
 
-    # Build path to config
-    config =  Path(args.config if args.config else f"/etc/wireguard/{args.interface}.conf").resolve()
+    # Build path to config, derive the strings used from here on only once
+    config_path = resolve_config(args.interface, args.config)
+    iface = config_path.stem
+    config = str(config_path)
 
     # --- Initial Interface Check ---
-    if not interface_is_up(config):
+    if not interface_is_up(iface):
         print(
-            f"[{time.ctime()}] Interface '{config.stem}' is already down. Exiting immediately."
+            f"[{time.ctime()}] Interface '{iface}' is already down. Exiting immediately."
         )
         sys.exit(0)
 
-    print(f"[{time.ctime()}] Interface '{config.stem}' is UP. Starting ZFS replication monitor.")
+    print(f"[{time.ctime()}] Interface '{iface}' is UP. Starting ZFS replication monitor.")
+
+    # Wake up as soon as a zfs process starts instead of sleeping through the interval
+    monitor = open_exec_monitor()
+    poller = select.poll()
+    if monitor is not None:
+        poller.register(monitor, select.POLLIN)
 
     # Use script start time as the reference for the grace period
     start_time = time.time()
+    start_bytes = interface_traffic_bytes(iface) if args.traffic_threshold > 0 else 0
 
     print(
         f"[{time.ctime()}] Duration (Grace Period): {args.timeout}s | Polling Interval: {args.interval}s"
     )
 
+    # The kernel ends the grace period with a one-shot SIGALRM. It is only let
+    # through while waiting, so a check in progress is never cut short.
+    signal.signal(signal.SIGALRM, raise_grace_period_expired)
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    signal.setitimer(signal.ITIMER_REAL, max(args.timeout, 0.001))
+
     try:
-        # Loop runs until the timeout expires
-        while (time.time() - start_time) < args.timeout:
+        try:
+            # Loop runs until the alarm fires
+            while True:
 
-            if replication_running():
-                # Activity found! Exit immediately, keeping the interface up.
-                print(f"[{time.ctime()}] Active replication detected. Keeping interface '{config.stem}' up.")
-                sys.exit(0)
+                # Tunnel traffic is read from two sysfs counters, the cheapest activity signal
+                if args.traffic_threshold > 0:
+                    transferred = interface_traffic_bytes(iface) - start_bytes
+                    if transferred > args.traffic_threshold:
+                        print(
+                            f"[{time.ctime()}] {transferred} bytes transferred over '{iface}'. "
+                            "Keeping interface up."
+                        )
+                        sys.exit(0)
 
-            # Log status and wait
-            idle_time = int(time.time() - start_time)
-            print(f"[{time.ctime()}] No active replication. Polling for {idle_time}s...")
+                if replication_running():
+                    # Activity found! Exit immediately, keeping the interface up.
+                    print(f"[{time.ctime()}] Active replication detected. Keeping interface '{iface}' up.")
+                    sys.exit(0)
 
-            # Calculate remaining time to sleep to avoid overshooting the timeout
-            time_to_sleep = min(args.interval, args.timeout - idle_time)
+                # Log status and wait
+                idle_time = int(time.time() - start_time)
+                print(f"[{time.ctime()}] No active replication. Polling for {idle_time}s...")
 
-            if time_to_sleep > 0:
-                time.sleep(time_to_sleep)
-            else:
-                # Break out if the remaining time is 0 or less, which means we've hit the timeout.
-                break
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+                try:
+                    woken = wait_for_zfs_exec(poller, monitor, args.interval)
+                finally:
+                    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+                if woken:
+                    print(f"[{time.ctime()}] zfs process started, checking replication early.")
+        except GracePeriodExpired:
+            pass
+        finally:
+            # Disarm the timer on every way out of the loop. Ignoring SIGALRM first
+            # discards an alarm that is still pending, so unblocking it is safe and
+            # child processes (wg-quick) do not inherit a blocked signal.
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_IGN)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
 
         # If the loop finished without finding activity, the grace period is over.
         print(
@@ -200,12 +545,12 @@ def main():
 
         # Since we checked if the interface was up at the start, we can proceed to bring it down.
         # However, checking again ensures idempotency in case of external changes.
-        if interface_is_up(config):
-            bring_down_interface(config)
+        if interface_is_up(iface):
+            bring_down_interface(config, iface)
         else:
             # This path is highly unlikely but included for robustness
             print(
-                f"[{time.ctime()}] Interface '{config.stem}' was already down. No action needed."
+                f"[{time.ctime()}] Interface '{iface}' was already down. No action needed."
             )
 
         sys.exit(0)
@@ -213,6 +558,8 @@ def main():
     except KeyboardInterrupt:
         print(f"\n[{time.ctime()}] Interrupted by user. Exiting.")
         sys.exit(0)
+    finally:
+        close_exec_monitor(monitor)
 
 
 if __name__ == "__main__":